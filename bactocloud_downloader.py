@@ -19,12 +19,20 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext, filedialog
-from datetime import datetime, time, timedelta
+from datetime import datetime, timedelta
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
 import json
 import os
 import platform
+import re
+import sys
+import functools
 import time as time_module
 from pathlib import Path
 from tkcalendar import DateEntry
@@ -32,6 +40,135 @@ from tkcalendar import DateEntry
 import jwt
 import sv_ttk
 
+# orjson is optional; it is several times faster than the standard json module
+# on large data list responses and measurement dumps
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Default and upper limit for the number of API requests (device lists and
+# file downloads) in flight at once; configurable as "Parallel downloads"
+DEFAULT_PARALLEL_DOWNLOADS = 16
+MAX_PARALLEL_DOWNLOADS = 32
+
+# Chunk and write-buffer size used when streaming downloaded files to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# (connect, read) timeouts in seconds for API requests and for file downloads,
+# so a stalled connection cannot hang a download forever
+REQUEST_TIMEOUT = (5, 60)
+FILE_DOWNLOAD_TIMEOUT = (5, 300)
+
+# Number of measurements requested per page from the data list endpoint
+DATA_LIST_PAGE_SIZE = 500
+
+# Measurement file codes mapped to (extension, file type):
+# "10" = PNG, "20" = FCS, "30" = CSV
+_FILE_TYPES = {
+    "10": ("png", "summary"),
+    "20": ("fcs", "data"),
+    "30": ("csv", "diagnostics")
+}
+
+# Seconds a loaded device list is reused before it is fetched again
+DEVICE_LIST_TTL = 60
+
+# Characters not allowed in folder and file names. \w matches exactly what
+# str.isalnum() accepts plus the underscore, so this keeps letters and digits
+# of any script together with ' ', '_' and '-'
+_SANITIZE_RE = re.compile(r"[^\w \-]")
+
+# The same rule as a table of bytes to delete, for the common ASCII-only names
+_SANITIZE_DELETE = bytes(i for i in range(256) if not (chr(i).isalnum() or chr(i) in " _-"))
+
+# Characters that cannot appear in a folder name on Windows or POSIX
+_RESERVED_PATH_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+# Date and time fields at the start of an API timestamp ("2024-01-31T10:05:00Z")
+_TS_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})", re.ASCII)
+
+# datetime.fromisoformat() accepts a trailing "Z" from Python 3.11 on
+_FROMISOFORMAT_ACCEPTS_Z = sys.version_info >= (3, 11)
+
+
+@functools.lru_cache(maxsize=1024)
+def sanitize_name(name):
+    """Make a measurement name safe to use in folder and file names"""
+    if name.isascii():
+        # bytes.translate deletes characters with a single table lookup each
+        return name.encode("ascii").translate(None, _SANITIZE_DELETE).strip().decode("ascii") or "unnamed"
+    return _SANITIZE_RE.sub("", name).strip() or "unnamed"
+
+
+def serial_number(device):
+    """Return a device's serial number, or "Unknown" when the API has none (or null)"""
+    return device.get("serial_number") or "Unknown"
+
+
+def sanitize_serial(serial):
+    """Make a device serial safe to use as a folder name
+
+    Only reserved characters are replaced, so serials that were already valid
+    folder names keep the folders of earlier downloads.
+    """
+    serial = _RESERVED_PATH_RE.sub("_", serial)
+    # "." and ".." would point outside the device's own folder
+    return serial if serial.strip(".") else "Unknown"
+
+
+@functools.lru_cache(maxsize=4096)
+def folder_timestamp(timestamp):
+    """Format an API timestamp as the date prefix of measurement folder and file names"""
+    # API timestamps are ISO 8601, so the fields are usually copied without
+    # building a datetime
+    match = _TS_RE.match(timestamp)
+    if match:
+        return "{}-{}-{}_{}-{}-{}".format(*match.groups())
+    if not _FROMISOFORMAT_ACCEPTS_Z and timestamp.endswith("Z"):
+        timestamp = timestamp[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(timestamp).strftime("%Y-%m-%d_%H-%M-%S")
+    except ValueError:
+        return "unknown_date"
+
+
+def loads_json(data):
+    """Decode JSON from bytes, using orjson when it is available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_json(obj, pretty=False):
+    """Encode an object as JSON bytes (compact unless pretty), using orjson when it is available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else None)
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def error_message(response):
+    """Return the error message of an API error response, or "Unknown error"
+
+    Errors from proxies (an HTML 502 page, for example) are not JSON objects,
+    so the body is parsed without letting a decoding error escape.
+    """
+    try:
+        return loads_json(response.content).get("error", "Unknown error")
+    except (ValueError, AttributeError):
+        return "Unknown error"
+
+
+def write_bytes_atomic(path, data):
+    """Write bytes through a temporary file so the target is never left half-written"""
+    part_path = path.with_name(path.name + ".part")
+    with open(part_path, 'wb') as f:
+        f.write(data)
+    os.replace(part_path, path)
+
+
 class BactoCloudDownloader:
     def __init__(self, root):
         self.root = root
@@ -42,20 +179,93 @@ class BactoCloudDownloader:
         self.output_dir = tk.StringVar(master=root, value=os.path.join(os.getcwd(), "downloads"))
         self.devices = []
         self.selected_devices = []
+        self.selected_buckets = []
+        self.selected_force_redownload = False
+        self.selected_pretty_json = False
+        self.selected_parallel_downloads = DEFAULT_PARALLEL_DOWNLOADS
+        self.selected_start_date = None
+        self.selected_end_date = None
+        self.selected_output_dir = None
         self.base_url = "https://api.bactocloud.com"
-        self.abort_download = False
+        # Set to stop a running download; checked by the workers between
+        # requests and between chunks of a file
+        self.abort_event = threading.Event()
+        
+        # (api_key, load time, devices) of the last device list fetched
+        self.devices_cache = None
+        # IDs of files downloaded or verified during this session. Files are
+        # immutable by ID, so these need no further request to the server
+        self.completed_files = set()
+        
+        # Log messages waiting to be written to the progress log
+        self.log_queue = queue.SimpleQueue()
+        
+        # Reuse one HTTP session so connections to the API are kept alive and
+        # pooled across requests instead of doing a TCP+TLS handshake each time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=MAX_PARALLEL_DOWNLOADS,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=1.0,
+                status_forcelist=[429, 500, 502, 503, 504],
+                # The data list POST is a read-only query, so it is safe to retry
+                allowed_methods=frozenset(["GET", "HEAD", "POST"]),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+        )
+        self.session.mount(self.base_url, adapter)
+        # Ask for compressed responses with every encoding urllib3 can decode
+        # here: gzip and deflate, plus br/zstd when brotli/zstandard is installed
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept-Encoding": ACCEPT_ENCODING
+        })
+        
+        # Keep the Authorization header on the session in sync with the API key,
+        # so individual requests do not need to pass headers at all
+        self.api_key.trace_add('write', self.update_auth_header)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Bucket selection variables
         self.bucket_auto = tk.BooleanVar(master=root, value=True)
         self.bucket_manual = tk.BooleanVar(master=root, value=True)
         self.bucket_monitoring = tk.BooleanVar(master=root, value=True)
         
+        # Download option variables
+        self.force_redownload = tk.BooleanVar(master=root, value=False)
+        self.pretty_json = tk.BooleanVar(master=root, value=False)
+        self.parallel_downloads = tk.IntVar(master=root, value=DEFAULT_PARALLEL_DOWNLOADS)
+        
+        # Pending debounced config save, and the config file contents last written
+        self.config_save_id = None
+        self.last_config_bytes = None
+        # Configuration directory, resolved and created on first use
+        self.config_dir = None
+        
         self.setup_menu()
         self.setup_ui()
         self.load_config()
         
+        # The spinbox command only runs for arrow clicks, so also save values
+        # typed into it (traced after loading, which needs no save)
+        self.parallel_downloads.trace_add('write', lambda *args: self.save_config())
+        
+    def on_close(self):
+        """Write any pending configuration, close the HTTP session and destroy the main window"""
+        if self.config_save_id is not None:
+            self.root.after_cancel(self.config_save_id)
+            self.write_config()
+        self.session.close()
+        self.root.destroy()
+    
     def get_config_dir(self):
         """Get the configuration directory based on the OS"""
+        if self.config_dir is not None:
+            return self.config_dir
+        
         system = platform.system()
         
         if system == "Windows":
@@ -72,6 +282,7 @@ class BactoCloudDownloader:
         
         # Create directory if it doesn't exist
         config_dir.mkdir(parents=True, exist_ok=True)
+        self.config_dir = config_dir
         return config_dir
     
     def get_config_file(self):
@@ -84,8 +295,9 @@ class BactoCloudDownloader:
         
         if config_file.exists():
             try:
-                with open(config_file, 'r') as f:
-                    config = json.load(f)
+                config_bytes = config_file.read_bytes()
+                config = loads_json(config_bytes)
+                self.last_config_bytes = config_bytes
                 
                 # Load saved values with type validation
                 if "api_key" in config and isinstance(config["api_key"], str):
@@ -100,6 +312,15 @@ class BactoCloudDownloader:
                     self.bucket_manual.set(config["bucket_manual"])
                 if "bucket_monitoring" in config and isinstance(config["bucket_monitoring"], bool):
                     self.bucket_monitoring.set(config["bucket_monitoring"])
+                
+                # Load download options
+                if "force_redownload" in config and isinstance(config["force_redownload"], bool):
+                    self.force_redownload.set(config["force_redownload"])
+                if "pretty_json" in config and isinstance(config["pretty_json"], bool):
+                    self.pretty_json.set(config["pretty_json"])
+                if ("parallel_downloads" in config and isinstance(config["parallel_downloads"], int)
+                        and not isinstance(config["parallel_downloads"], bool)):
+                    self.parallel_downloads.set(config["parallel_downloads"])
                     
                 # Only log if progress_text widget exists
                 if hasattr(self, 'progress_text'):
@@ -110,7 +331,16 @@ class BactoCloudDownloader:
                     self.log(f"Warning: Could not load configuration: {str(e)}")
     
     def save_config(self):
-        """Save configuration to file"""
+        """Save configuration to file one second after the last change"""
+        # Rapid changes (toggling several checkboxes, spinning the parallel
+        # downloads value) collapse into a single write
+        if self.config_save_id is not None:
+            self.root.after_cancel(self.config_save_id)
+        self.config_save_id = self.root.after(1000, self.write_config)
+    
+    def write_config(self):
+        """Write the configuration file if it changed since it was last written"""
+        self.config_save_id = None
         config_file = self.get_config_file()
         
         try:
@@ -119,12 +349,19 @@ class BactoCloudDownloader:
                 "output_dir": self.output_dir.get(),
                 "bucket_auto": self.bucket_auto.get(),
                 "bucket_manual": self.bucket_manual.get(),
-                "bucket_monitoring": self.bucket_monitoring.get()
+                "bucket_monitoring": self.bucket_monitoring.get(),
+                "force_redownload": self.force_redownload.get(),
+                "pretty_json": self.pretty_json.get(),
+                "parallel_downloads": self.get_parallel_downloads()
             }
             
-            with open(config_file, 'w') as f:
-                json.dump(config, f, indent=2)
-                
+            config_bytes = dumps_json(config, pretty=True)
+            if config_bytes == self.last_config_bytes:
+                return
+            
+            write_bytes_atomic(config_file, config_bytes)
+            self.last_config_bytes = config_bytes
+            
             self.log("Configuration saved successfully")
         except Exception as e:
             self.log(f"Warning: Could not save configuration: {str(e)}")
@@ -151,8 +388,9 @@ class BactoCloudDownloader:
     
     def browse_directory(self):
         """Open a directory selector dialog"""
+        # Fall back to the working directory when no existing folder is set
         initial_dir = self.output_dir.get()
-        if not os.path.exists(initial_dir):
+        if not (initial_dir and Path(initial_dir).is_dir()):
             initial_dir = os.getcwd()
         
         directory = filedialog.askdirectory(
@@ -188,26 +426,6 @@ class BactoCloudDownloader:
         )
 
         api_frame.columnconfigure(1, weight=1)
-    def update_org_id_from_api_key(self, *args):
-        key = self.api_key.get()
-        if not key:
-            self.org_id_var.set("")
-            return
-        try:
-            # JWTs are usually in three parts separated by dots
-            parts = key.split('.')
-            if len(parts) != 3:
-                self.org_id_var.set("Invalid JWT format")
-                return
-            # Decode without verification (no secret needed)
-            claims = jwt.decode(key, options={"verify_signature": False, "verify_aud": False})
-            org_id = claims.get("organizationID")
-            if org_id:
-                self.org_id_var.set(f"Organization ID: {org_id}")
-            else:
-                self.org_id_var.set("Organization ID not found")
-        except Exception as e:
-            self.org_id_var.set(f"JWT error: {str(e)}")
         
         # Device Selection Section
         device_frame = ttk.LabelFrame(self.root, text="Device Selection", padding=10)
@@ -263,8 +481,10 @@ class BactoCloudDownloader:
         date_frame.pack(fill="x", padx=10, pady=5)
         
         # Calculate default dates: start = 3 months ago, end = today
-        default_end_date = datetime.now().date()
-        default_start_date = (datetime.now() - timedelta(days=90)).date()
+        # Read the clock once so both dates agree even across midnight
+        now = datetime.now()
+        default_end_date = now.date()
+        default_start_date = (now - timedelta(days=90)).date()
         
         ttk.Label(date_frame, text="Start Date:").grid(row=0, column=0, sticky="w", pady=5)
         self.start_date = DateEntry(date_frame, width=20, background='darkblue',
@@ -290,6 +510,36 @@ class BactoCloudDownloader:
             side="right", padx=5
         )
         
+        # Download Options Section
+        options_frame = ttk.LabelFrame(self.root, text="Download Options", padding=10)
+        options_frame.pack(fill="x", padx=10, pady=5)
+        
+        ttk.Checkbutton(
+            options_frame,
+            text="Force redownload (ignore files already downloaded)",
+            variable=self.force_redownload,
+            command=self.save_config
+        ).grid(row=0, column=0, sticky="w", padx=5, pady=2)
+        
+        ttk.Checkbutton(
+            options_frame,
+            text="Pretty-print measurement JSON (larger files)",
+            variable=self.pretty_json,
+            command=self.save_config
+        ).grid(row=1, column=0, sticky="w", padx=5, pady=2)
+        
+        parallel_frame = ttk.Frame(options_frame)
+        parallel_frame.grid(row=2, column=0, sticky="w", padx=5, pady=2)
+        
+        ttk.Label(parallel_frame, text="Parallel downloads:").pack(side="left")
+        ttk.Spinbox(
+            parallel_frame,
+            from_=1,
+            to=MAX_PARALLEL_DOWNLOADS,
+            width=5,
+            textvariable=self.parallel_downloads
+        ).pack(side="left", padx=5)
+        
         # Download and Abort Buttons
         button_frame = ttk.Frame(self.root)
         button_frame.pack(pady=10)
@@ -325,52 +575,106 @@ class BactoCloudDownloader:
         self.progress_bar = ttk.Progressbar(progress_frame, mode='indeterminate')
         self.progress_bar.pack(fill="x", pady=5)
         
+        # Start writing queued log messages to the progress log
+        self.root.after(100, self.drain_log)
+        
+    def update_org_id_from_api_key(self, *args):
+        key = self.api_key.get()
+        if not key:
+            self.org_id_var.set("")
+            return
+        try:
+            # JWTs are usually in three parts separated by dots
+            parts = key.split('.')
+            if len(parts) != 3:
+                self.org_id_var.set("Invalid JWT format")
+                return
+            # Decode without verification (no secret needed)
+            claims = jwt.decode(key, options={"verify_signature": False, "verify_aud": False})
+            org_id = claims.get("organizationID")
+            if org_id:
+                self.org_id_var.set(f"Organization ID: {org_id}")
+            else:
+                self.org_id_var.set("Organization ID not found")
+        except Exception as e:
+            self.org_id_var.set(f"JWT error: {str(e)}")
+        
+    def get_parallel_downloads(self):
+        """Get the configured number of parallel downloads, clamped to the allowed range"""
+        try:
+            value = self.parallel_downloads.get()
+        except tk.TclError:
+            # The spinbox does not hold a valid number
+            value = DEFAULT_PARALLEL_DOWNLOADS
+        return min(max(value, 1), MAX_PARALLEL_DOWNLOADS)
+    
     def log(self, message):
-        """Add a message to the progress log"""
-        self.progress_text.config(state="normal")
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.progress_text.insert("end", f"[{timestamp}] {message}\n")
-        self.progress_text.see("end")
-        self.progress_text.config(state="disabled")
-        self.root.update_idletasks()
-        
-    def get_headers(self):
-        """Get API headers with authentication"""
-        return {
-            "Authorization": f"Bearer {self.api_key.get()}",
-            "Content-Type": "application/json"
-        }
+        """Add a message to the progress log (safe to call from any thread)"""
+        self.log_queue.put_nowait((datetime.now(), message))
+    
+    def drain_log(self):
+        """Write queued log messages to the progress log, then reschedule itself"""
+        # Drain in batches on a fixed 10 Hz tick so the widget is redrawn at most
+        # ten times per second, however many lines a download produces
+        lines = []
+        try:
+            while len(lines) < 200:
+                timestamp, message = self.log_queue.get_nowait()
+                lines.append(f"[{timestamp.strftime('%H:%M:%S')}] {message}\n")
+        except queue.Empty:
+            pass
+        
+        if lines:
+            self.progress_text.config(state="normal")
+            self.progress_text.insert("end", "".join(lines))
+            self.progress_text.see("end")
+            self.progress_text.config(state="disabled")
+        
+        self.root.after(100, self.drain_log)
+        
+    def update_auth_header(self, *args):
+        """Set the session's Authorization header from the current API key"""
+        key = self.api_key.get()
+        if key:
+            self.session.headers["Authorization"] = f"Bearer {key}"
+        else:
+            self.session.headers.pop("Authorization", None)
     
     def make_request_with_retry(self, method, url, max_retries=5, **kwargs):
-        """Make an API request with retry logic for 429 errors"""
+        """Make an API request with retry logic for 429 errors
+
+        Connection errors and timeouts are not retried here: the session's
+        adapter has already retried them, so they are raised to the caller.
+        """
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
         for attempt in range(max_retries):
-            try:
-                if method.lower() == 'get':
-                    response = requests.get(url, **kwargs)
-                elif method.lower() == 'post':
-                    response = requests.post(url, **kwargs)
-                else:
-                    raise ValueError(f"Unsupported HTTP method: {method}")
-                
-                # If we get a 429, wait and retry
-                if response.status_code == 429:
-                    if attempt < max_retries - 1:
-                        self.log(f"    Rate limit reached (429), waiting 30 seconds before retry {attempt + 1}/{max_retries - 1}...")
-                        time_module.sleep(30)
-                        continue
-                    else:
-                        self.log(f"    Rate limit reached (429), max retries exceeded")
-                        return response
-                
-                # For any other status code, return immediately
-                return response
-                
-            except Exception as e:
+            if method.lower() == 'get':
+                response = self.session.get(url, **kwargs)
+            elif method.lower() == 'post':
+                response = self.session.post(url, **kwargs)
+            elif method.lower() == 'head':
+                response = self.session.head(url, **kwargs)
+            else:
+                raise ValueError(f"Unsupported HTTP method: {method}")
+            
+            # The session already retried 429s with a short backoff; if the
+            # rate limit persists, wait longer before trying again
+            if response.status_code == 429:
                 if attempt < max_retries - 1:
-                    self.log(f"    Request error, retrying in 5 seconds: {str(e)}")
-                    time_module.sleep(5)
+                    self.log(f"    Rate limit reached (429), waiting 30 seconds before retry {attempt + 1}/{max_retries - 1}...")
+                    # Drain the (small) body so a streamed response hands its
+                    # connection back to the pool instead of closing it
+                    response.content
+                    # Wait on the abort event so an abort cuts the wait short
+                    if self.abort_event.wait(30):
+                        return response
+                    continue
                 else:
-                    raise
+                    self.log(f"    Rate limit reached (429), max retries exceeded")
+                    return response
+            
+            # For any other status code, return immediately
+            return response
         
         return response
         
@@ -384,27 +688,36 @@ class BactoCloudDownloader:
         self.device_listbox.delete(0, tk.END)
         
         try:
-            response = self.make_request_with_retry(
-                'get',
-                f"{self.base_url}/api/v1/device",
-                headers=self.get_headers(),
-                params={"no_virtual": "false"}
-            )
+            api_key = self.api_key.get()
+            if (self.devices_cache is not None and self.devices_cache[0] == api_key
+                    and time_module.monotonic() - self.devices_cache[1] < DEVICE_LIST_TTL):
+                # Reuse the list loaded moments ago instead of asking the API again
+                self.devices = self.devices_cache[2]
+                response = None
+            else:
+                response = self.make_request_with_retry(
+                    'get',
+                    f"{self.base_url}/api/v1/device",
+                    params={"no_virtual": "false"}
+                )
+                if response.status_code == 200:
+                    self.devices = loads_json(response.content)
+                    self.devices_cache = (api_key, time_module.monotonic(), self.devices)
             
-            if response.status_code == 200:
-                self.devices = response.json()
-                for device in self.devices:
-                    serial = device.get("serial_number", "Unknown")
-                    name = device.get("name", "Unnamed")
-                    self.device_listbox.insert("end", f"{serial} - {name}")
+            if response is None or response.status_code == 200:
+                # Insert all rows in a single call rather than one Tk call per device
+                self.device_listbox.insert("end", *[
+                    f"{serial_number(device)} - {device.get('name', 'Unnamed')}"
+                    for device in self.devices
+                ])
                 
-                self.log(f"Loaded {len(self.devices)} devices")
+                self.log(f"Loaded {len(self.devices)} devices{'' if response is not None else ' (cached)'}")
                 self.download_btn.config(state="normal")
                 
                 # Save configuration after successful device load
                 self.save_config()
             else:
-                error_msg = response.json().get("error", "Unknown error")
+                error_msg = error_message(response)
                 self.log(f"Error loading devices: {error_msg}")
                 messagebox.showerror("Error", f"Failed to load devices: {error_msg}")
         except Exception as e:
@@ -413,7 +726,7 @@ class BactoCloudDownloader:
             
     def abort_download_process(self):
         """Abort the ongoing download process"""
-        self.abort_download = True
+        self.abort_event.set()
         self.log("Abort requested by user...")
         
     def start_download(self):
@@ -423,9 +736,21 @@ class BactoCloudDownloader:
             messagebox.showwarning("Warning", "Please select at least one device")
             return
         
+        # Build bucket list based on selection, reading each variable once here
+        # on the Tk thread rather than from the download thread
+        buckets = [
+            name for name, selected in (
+                ("auto", self.bucket_auto),
+                ("manual", self.bucket_manual),
+                ("monitoring", self.bucket_monitoring)
+            ) if selected.get()
+        ]
+        
         # Check if at least one bucket is selected
-        if not (self.bucket_auto.get() or self.bucket_manual.get() or self.bucket_monitoring.get()):
+        if not buckets:
             messagebox.showwarning("Warning", "Please select at least one bucket type")
+            return
+        
         # Validate that start date and end date are different
         start_dt = self.start_date.get_date()
         end_dt = self.end_date.get_date()
@@ -439,9 +764,17 @@ class BactoCloudDownloader:
             return
             
         self.selected_devices = [self.devices[i] for i in selected_indices]
+        self.selected_buckets = buckets
+        # Download workers read these copies instead of the Tk variables
+        self.selected_force_redownload = self.force_redownload.get()
+        self.selected_pretty_json = self.pretty_json.get()
+        self.selected_parallel_downloads = self.get_parallel_downloads()
+        self.selected_start_date = start_dt
+        self.selected_end_date = end_dt
+        self.selected_output_dir = self.output_dir.get()
         
         # Reset abort flag
-        self.abort_download = False
+        self.abort_event.clear()
         
         # Disable download button and enable abort button during download
         self.download_btn.config(state="disabled")
@@ -455,90 +788,139 @@ class BactoCloudDownloader:
     def download_data(self):
         """Download data for selected devices and date range"""
         try:
-            # Create start and end datetime objects
-            start_datetime = datetime.combine(self.start_date.get_date(), time(0, 0, 0))
-            end_datetime = datetime.combine(self.end_date.get_date(), time(23, 59, 59))
+            # The range covers whole days, from midnight of the start date to
+            # the last second of the end date
+            start_date = self.selected_start_date
+            end_date = self.selected_end_date
+            
+            self.log(f"Date range: {start_date} 00:00:00 to {end_date} 23:59:59")
+            
+            buckets = self.selected_buckets
+            
+            # The date range and buckets are the same for every query, so build
+            # the filter once and only vary the device IDs and page per request
+            base_filter = {
+                "start_date": f"{start_date:%Y-%m-%d}T00:00:00Z",
+                "end_date": f"{end_date:%Y-%m-%d}T23:59:59Z",
+                "page_size": DATA_LIST_PAGE_SIZE,
+                "with_computations": True,
+                "buckets": buckets,
+                # Pages are offsets into the result, so keep them in a fixed
+                # order; measurements added during the download then land at
+                # the end instead of shifting items between pages
+                "sort_field": "timestamp",
+                "sort_order": "asc"
+            }
             
-            self.log(f"Date range: {start_datetime} to {end_datetime}")
+            # Log the shared filter once rather than with every device query
+            self.log(f"Buckets: {', '.join(buckets)}")
+            self.log(f"Filter template: {base_filter}")
             
             total_downloaded = 0
+            aborted = False
             
-            for device in self.selected_devices:
-                # Check if abort was requested
-                if self.abort_download:
-                    self.log("\n=== Download Aborted by User ===")
-                    messagebox.showinfo("Aborted", f"Download aborted. {total_downloaded} measurements were downloaded before abort.")
-                    break
+            parallel_downloads = self.selected_parallel_downloads
+            self.log(f"Parallel downloads: {parallel_downloads}")
+            
+            # Device list queries and measurement downloads are network-bound,
+            # so run them concurrently on a bounded pool of worker threads
+            with ThreadPoolExecutor(max_workers=parallel_downloads) as executor:
+                file_futures = []
                 
-                device_id = device.get("id")
-                device_serial = device.get("serial_number", "Unknown")
+                output_root = Path(self.selected_output_dir)
                 
-                self.log(f"\nProcessing device: {device_serial}")
+                # Measurements with the same timestamp and name share their file
+                # names. Each path is queued once, so two workers never write the
+                # same .part file (or resume one the other is still writing)
+                queued_paths = set()
+                queued_paths_lock = threading.Lock()
                 
-                # Build bucket list based on selection
-                buckets = []
-                if self.bucket_auto.get():
-                    buckets.append("auto")
-                if self.bucket_manual.get():
-                    buckets.append("manual")
-                if self.bucket_monitoring.get():
-                    buckets.append("monitoring")
+                def queue_measurements(devices):
+                    # Queue the files of each measurement as soon as its page arrives
+                    # so file downloads overlap with fetching the next page. Every
+                    # file is its own task, so one measurement's files download in
+                    # parallel and no task waits on another one in the pool
+                    devices_by_id = {device.get("id"): device for device in devices}
+                    device_roots = {}
+                    processed = 0
+                    for data_item in self.iter_measurements(devices, base_filter):
+                        if len(devices) == 1:
+                            device = devices[0]
+                        else:
+                            device = devices_by_id.get(data_item.get("deviceID"), {})
+                        device_serial = serial_number(device)
+                        
+                        try:
+                            # Create each device folder once, not for every measurement
+                            device_root = device_roots.get(device_serial)
+                            if device_root is None:
+                                # The serial comes from the API, so it may contain path separators
+                                device_root = output_root / sanitize_serial(device_serial)
+                                device_root.mkdir(parents=True, exist_ok=True)
+                                device_roots[device_serial] = device_root
+                            
+                            downloads = self.process_measurement(data_item, device_root)
+                        except Exception as e:
+                            self.log(f"Error processing measurement: {str(e)}")
+                            continue
+                        processed += 1
+                        
+                        for file_id, file_path, label in downloads:
+                            with queued_paths_lock:
+                                duplicate = file_path in queued_paths
+                                queued_paths.add(file_path)
+                            if duplicate:
+                                self.log(f"    ⚠ {label} file {file_path.name} already queued for another measurement, skipped")
+                                continue
+                            file_futures.append(
+                                executor.submit(self.download_file, file_id, file_path, label)
+                            )
+                    return processed
                 
-                # Log selected buckets
-                self.log(f"  Buckets: {', '.join(buckets)}")
+                # A single list query covers all regular devices. Virtual devices
+                # are queried on their own, as their measurements may carry the
+                # ID of another device
+                regular_devices = [d for d in self.selected_devices if not d.get("virtual")]
+                device_groups = [[d] for d in self.selected_devices if d.get("virtual")]
+                if regular_devices:
+                    device_groups.append(regular_devices)
                 
-                # Prepare filter for data query
-                filter_data = {
-                    "device_ids": [device_id],
-                    "start_date": start_datetime.isoformat() + "Z",
-                    "end_date": end_datetime.isoformat() + "Z",
-                    "page_size": 10000,
-                    "with_computations": True,
-                    "page": 0
+                # Map each group to its serials up front, so logging a failed
+                # group cannot fail itself
+                device_futures = {
+                    executor.submit(queue_measurements, devices): ", ".join(map(serial_number, devices))
+                    for devices in device_groups
                 }
-                
-                # Add buckets filter if any are selected
-                filter_data["buckets"] = buckets
-                
-                self.log("filtering data...")
-                self.log(f"  Filter: {filter_data}")
-
-                # Get data list
-                response = self.make_request_with_retry(
-                    'post',
-                    f"{self.base_url}/api/v1/data/list",
-                    headers=self.get_headers(),
-                    json=filter_data
-                )
-                
-                if response.status_code != 200:
-                    error_msg = response.json().get("error", "Unknown error")
-                    self.log(f"Error fetching data: {error_msg}")
-                    continue
-                
-                result = response.json()
-                data_list = result.get("data", [])
-                if not data_list:
-                    self.log("  No measurements found for this device in the specified date range and buckets.")
-                    continue
-                self.log(f"Found {len(data_list)} measurements")
-                
-                # Process each measurement
-                for data_item in data_list:
-                    # Check if abort was requested
-                    if self.abort_download:
-                        self.log("\n=== Download Aborted by User ===")
-                        messagebox.showinfo("Aborted", f"Download aborted. {total_downloaded} measurements were downloaded before abort.")
-                        return
-                    
+                for future in as_completed(device_futures):
+                    if self.abort_event.is_set():
+                        aborted = True
+                        break
                     try:
-                        self.process_measurement(data_item, device_serial)
-                        total_downloaded += 1
+                        total_downloaded += future.result()
                     except Exception as e:
-                        self.log(f"Error processing measurement: {str(e)}")
+                        # Skip this group and carry on with the other devices
+                        self.log(f"Error processing {device_futures[future]}: {str(e)}")
+                
+                if not aborted:
+                    # Errors are logged by download_file itself
+                    for future in as_completed(file_futures):
+                        # Check if abort was requested
+                        if self.abort_event.is_set():
+                            aborted = True
+                            break
+                
+                # Workers stop early on abort, so everything may have completed
+                # before the loops above noticed it
+                aborted = aborted or self.abort_event.is_set()
+                if aborted:
+                    # Drop queued work; downloads in flight stop at their next chunk
+                    for future in [*device_futures, *file_futures]:
+                        future.cancel()
             
-            # Only show completion if not aborted
-            if not self.abort_download:
+            if aborted:
+                self.log("\n=== Download Aborted by User ===")
+                messagebox.showinfo("Aborted", f"Download aborted. {total_downloaded} measurements were downloaded before abort.")
+            else:
                 self.log(f"\n=== Download Complete ===")
                 self.log(f"Total measurements downloaded: {total_downloaded}")
                 messagebox.showinfo("Success", f"Downloaded {total_downloaded} measurements")
@@ -550,29 +932,87 @@ class BactoCloudDownloader:
             self.progress_bar.stop()
             self.download_btn.config(state="normal")
             self.abort_btn.config(state="disabled")
+    
+    def iter_measurements(self, devices, base_filter):
+        """Yield the measurements of one or more devices, fetching the list page by page"""
+        device_serials = ", ".join(map(serial_number, devices))
+        
+        self.log(f"\nProcessing {'devices' if len(devices) > 1 else 'device'}: {device_serials}")
+        
+        # Prepare filter for data query
+        filter_data = {
+            **base_filter,
+            "device_ids": [device.get("id") for device in devices],
+            "page": 0
+        }
+        
+        received = 0
+        while not self.abort_event.is_set():
+            # Get one page of the data list
+            try:
+                response = self.make_request_with_retry(
+                    'post',
+                    f"{self.base_url}/api/v1/data/list",
+                    # Encode the body once per page with orjson when available; the
+                    # session already sends Content-Type: application/json
+                    data=dumps_json(filter_data)
+                )
+            except requests.Timeout:
+                # Give up on these devices only; the other queries keep going
+                self.log(f"Timed out fetching data for {device_serials}, skipping")
+                return
+            
+            if response.status_code != 200:
+                error_msg = error_message(response)
+                self.log(f"Error fetching data for {device_serials}: {error_msg}")
+                
+                # If the combined query is rejected, fall back to one query per device
+                if len(devices) > 1 and filter_data["page"] == 0:
+                    self.log("  Retrying with one query per device...")
+                    for device in devices:
+                        yield from self.iter_measurements([device], base_filter)
+                return
+            
+            result = loads_json(response.content)
+            data_list = result.get("data", [])
+            total = result.get("count")
+            if filter_data["page"] == 0:
+                if not data_list:
+                    self.log(f"  No measurements found for {device_serials} in the specified date range and buckets.")
+                    return
+                self.log(f"Found {total if total is not None else len(data_list)} measurements for {device_serials}")
+            
+            yield from data_list
             
-    def process_measurement(self, data_item, device_serial):
-        """Process a single measurement - download files and save JSON"""
+            # A short page or reaching the reported total means this was the last page
+            received += len(data_list)
+            if len(data_list) < DATA_LIST_PAGE_SIZE or (total is not None and received >= total):
+                break
+            self.log(f"  Listed {received} of {total if total is not None else '?'} measurements "
+                     f"for {device_serials}, fetching next page...")
+            filter_data["page"] += 1
+            
+    def process_measurement(self, data_item, device_root):
+        """Save a measurement's JSON and return the (file_id, file_path, label) of its files"""
+        if self.abort_event.is_set():
+            return []
+        
         # Extract measurement info
         data_id = data_item.get("_id")
         timestamp = data_item.get("timestamp", "")
         name = data_item.get("name", "unnamed")
         
         # Parse timestamp for folder name and file prefix
-        try:
-            dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-            date_str = dt.strftime("%Y-%m-%d_%H-%M-%S")
-        except (ValueError, AttributeError, TypeError):
-            date_str = "unknown_date"
+        date_str = folder_timestamp(timestamp) if isinstance(timestamp, str) else "unknown_date"
         
         # Sanitize name for filesystem
-        safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '_', '-')).strip()
-        safe_name = safe_name or "unnamed"
+        safe_name = sanitize_name(name)
         
         # Create folder structure: /device_serial/measurement_date_measurement_name/
+        # (device_root already exists, so only the measurement folder is created)
         folder_name = f"{date_str}_{safe_name}"
-        output_path = Path(self.output_dir.get()) / device_serial / folder_name
-        output_path.mkdir(parents=True, exist_ok=True)
+        output_path = device_root / folder_name
+        output_path.mkdir(exist_ok=True)
         
         # Create file prefix for all files
         file_prefix = f"{date_str}_{safe_name}"
@@ -581,40 +1021,138 @@ class BactoCloudDownloader:
         
         # Save measurement data as JSON
         json_path = output_path / f"{file_prefix}_result.json"
-        with open(json_path, 'w') as f:
-            json.dump(data_item, f, indent=2)
+        write_bytes_atomic(json_path, dumps_json(data_item, pretty=self.selected_pretty_json))
         
-        # Download files if available
+        # Collect the files to download, if available
+        downloads = []
         files = data_item.get("files", {})
         if files:
-            # File type mapping: "10" = PNG, "20" = FCS, "30" = CSV
-            file_types = {
-                "10": ("png", "summary"),
-                "20": ("fcs", "data"),
-                "30": ("csv", "diagnostics")
-            }
-            
             for file_code, file_id in files.items():
-                if file_code in file_types:
-                    extension, file_type = file_types[file_code]
-                    try:
-                        file_response = self.make_request_with_retry(
-                            'get',
-                            f"{self.base_url}/api/v1/data/file/{file_id}",
-                            headers=self.get_headers()
-                        )
-                        
-                        if file_response.status_code == 200:
-                            file_path = output_path / f"{file_prefix}_{file_type}.{extension}"
-                            with open(file_path, 'wb') as f:
-                                f.write(file_response.content)
-                            self.log(f"    ✓ Downloaded {extension.upper()} file ({len(file_response.content)} bytes)")
-                        else:
-                            self.log(f"    ⚠ {extension.upper()} file not available (status: {file_response.status_code})")
-                    except Exception as e:
-                        self.log(f"    ⚠ Error downloading {extension.upper()}: {str(e)}")
+                if file_code in _FILE_TYPES:
+                    extension, file_type = _FILE_TYPES[file_code]
+                    file_path = output_path / f"{file_prefix}_{file_type}.{extension}"
+                    downloads.append((file_id, file_path, extension.upper()))
         else:
             self.log(f"    ⚠ No files available for this measurement")
+        
+        return downloads
+    
+    def download_file(self, file_id, file_path, label):
+        """Download a measurement file, skipping it if the local copy is still current"""
+        if self.abort_event.is_set():
+            return
+        
+        url = f"{self.base_url}/api/v1/data/file/{file_id}"
+        headers = {}
+        force = self.selected_force_redownload
+        
+        etag_path = file_path.with_name(file_path.name + ".etag")
+        part_path = file_path.with_name(file_path.name + ".part")
+        
+        try:
+            append = False
+            if not force and file_id in self.completed_files and file_path.exists():
+                self.log(f"    ✓ {label} file already downloaded this session, skipped")
+                return
+            if not force and file_path.exists():
+                if etag_path.exists():
+                    # The ETag of the last download is kept next to the file; the
+                    # server answers 304 Not Modified when it still matches
+                    headers["If-None-Match"] = etag_path.read_text().strip()
+                else:
+                    # Without an ETag, a HEAD request tells whether the local
+                    # copy has the size of the file on the server. Ask for the
+                    # unencoded size, since that is what ends up on disk
+                    head_response = self.make_request_with_retry(
+                        'head', url, headers={"Accept-Encoding": "identity"}
+                    )
+                    content_length = head_response.headers.get("Content-Length")
+                    if (head_response.status_code == 200
+                            and content_length == str(file_path.stat().st_size)):
+                        etag = head_response.headers.get("ETag")
+                        if etag:
+                            etag_path.write_text(etag)
+                        self.completed_files.add(file_id)
+                        self.log(f"    ✓ {label} file already downloaded, skipped (size matches)")
+                        return
+            elif not force and part_path.exists() and part_path.stat().st_size > 0:
+                # Resume an interrupted download where it stopped (files are
+                # immutable by ID, so the partial data is still valid)
+                headers["Range"] = f"bytes={part_path.stat().st_size}-"
+                # The offset counts decoded bytes, so the body must not be encoded
+                headers["Accept-Encoding"] = "identity"
+                append = True
+            
+            file_response = self.make_request_with_retry(
+                'get',
+                url,
+                headers=headers,
+                stream=True,
+                timeout=FILE_DOWNLOAD_TIMEOUT
+            )
+            
+            with file_response:
+                if file_response.status_code not in (200, 206):
+                    # Drain the (small) body so closing the response keeps the
+                    # connection alive for the next request
+                    file_response.content
+                
+                if file_response.status_code == 304:
+                    self.completed_files.add(file_id)
+                    self.log(f"    ✓ {label} file unchanged, skipped (cached)")
+                elif file_response.status_code in (200, 206):
+                    # A 200 answer to a range request carries the whole file
+                    append = append and file_response.status_code == 206
+                    size = self.write_response_to_file(file_response, file_path, append)
+                    if size is None:
+                        self.log(f"    ⚠ {label} download aborted, partial file kept")
+                        return
+                    etag = file_response.headers.get("ETag")
+                    if etag:
+                        etag_path.write_text(etag)
+                    elif etag_path.exists():
+                        etag_path.unlink()
+                    self.completed_files.add(file_id)
+                    if append:
+                        self.log(f"    ✓ Resumed {label} file ({size} more bytes)")
+                    else:
+                        self.log(f"    ✓ Downloaded {label} file ({size} bytes)")
+                elif file_response.status_code == 416 and append:
+                    # The partial file cannot be resumed; start over
+                    part_path.unlink()
+                    self.download_file(file_id, file_path, label)
+                else:
+                    self.log(f"    ⚠ {label} file not available (status: {file_response.status_code})")
+        except requests.Timeout:
+            # Any partial data is kept in the .part file and resumed next time
+            self.log(f"    ⚠ Timed out downloading {label}, skipped")
+        except Exception as e:
+            self.log(f"    ⚠ Error downloading {label}: {str(e)}")
+    
+    def write_response_to_file(self, response, file_path, append=False):
+        """Stream a response body to disk in chunks and return the number of bytes written
+
+        Returns None if the download was aborted; the data received so far is
+        kept in the .part file so the download can be resumed later.
+        """
+        # Write to a temporary file and move it into place once complete, so an
+        # interrupted download never leaves a truncated file behind
+        part_path = file_path.with_name(file_path.name + ".part")
+        
+        # This runs on a download worker thread; file writes release the GIL,
+        # so disk I/O here overlaps with network reads on the other workers
+        size = 0
+        with open(part_path, 'ab' if append else 'wb', buffering=DOWNLOAD_CHUNK_SIZE) as f:
+            # Hint the OS that the file is written sequentially (POSIX only)
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+                if self.abort_event.is_set():
+                    return None
+        os.replace(part_path, file_path)
+        return size
 
 
 def main():
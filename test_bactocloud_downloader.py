@@ -3,25 +3,107 @@ Unit tests for BactoCloud Downloader
 """
 
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, mock_open
 from datetime import datetime, date, timedelta
 import json
 import os
 import tempfile
-import shutil
+import threading
+import time
+import functools
+from types import MappingProxyType
+from pathlib import Path
 
+import bactocloud_downloader
+from bactocloud_downloader import sanitize_name, sanitize_serial, folder_timestamp, loads_json, dumps_json
 
-class TestBactoCloudDownloaderCore(unittest.TestCase):
-    """Test cases for core BactoCloud Downloader functionality"""
+# Bucket lists for all 8 combinations of (auto, manual, monitoring) selections,
+# indexed by the bitmask auto << 2 | manual << 1 | monitoring
+_BUCKETS = tuple(
+    tuple(name for selected, name in zip((auto, manual, monitoring), ("auto", "manual", "monitoring")) if selected)
+    for auto in (0, 1) for manual in (0, 1) for monitoring in (0, 1)
+)
+
+# Test payloads, built once and read-only so no test can alter another's data
+_DEVICE_PAYLOAD = (
+    MappingProxyType({"_id": "1", "serial_number": "SN001", "name": "Device 1"}),
+    MappingProxyType({"_id": "2", "serial_number": "SN002", "name": "Device 2"})
+)
+_CONFIG_PAYLOAD = MappingProxyType({
+    "api_key": "test_key_123",
+    "output_dir": "/path/to/output"
+})
+_BUCKET_CONFIG_PAYLOAD = MappingProxyType({
+    **_CONFIG_PAYLOAD,
+    "bucket_auto": True,
+    "bucket_manual": False,
+    "bucket_monitoring": True
+})
+
+
+@functools.lru_cache(maxsize=None)
+def _ensure_dir(path):
+    """Create a directory and its parents, once per path"""
+    os.makedirs(path, exist_ok=True)
+
+
+def _mock_ok(payload):
+    """Build a mocked 200 response carrying the given list of JSON objects"""
+    response = Mock(status_code=200, content=dumps_json([dict(item) for item in payload]))
+    response.json.return_value = payload
+    return response
+
+
+class _FakeResponse:
+    """Minimal stand-in for a streamed requests response"""
     
-    def setUp(self):
-        """Set up test fixtures"""
-        self.temp_dir = tempfile.mkdtemp()
-        
-    def tearDown(self):
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+    
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _make_downloader(responses):
+    """Build a downloader without a UI whose requests return the given responses in order"""
+    app = bactocloud_downloader.BactoCloudDownloader.__new__(bactocloud_downloader.BactoCloudDownloader)
+    app.base_url = "https://api.example.com"
+    app.abort_event = threading.Event()
+    app.completed_files = set()
+    app.selected_force_redownload = False
+    app.log = Mock()
+    app.make_request_with_retry = Mock(side_effect=responses)
+    return app
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Base class giving each test class its own temporary directory"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures shared by all tests of the class"""
+        cls.temp_dir_context = tempfile.TemporaryDirectory(prefix=f"bcd_{cls.__name__}_")
+        cls.temp_dir = cls.temp_dir_context.name
+    
+    @classmethod
+    def tearDownClass(cls):
         """Clean up test fixtures"""
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
+        cls.temp_dir_context.cleanup()
+        # The directories are gone, so forget that they were created
+        _ensure_dir.cache_clear()
+
+
+class TestBactoCloudDownloaderCore(TempDirTestCase):
+    """Test cases for core BactoCloud Downloader functionality"""
     
     def test_api_headers(self):
         """Test that API headers are generated correctly"""
@@ -37,13 +119,7 @@ class TestBactoCloudDownloaderCore(unittest.TestCase):
     def test_load_devices_api_call(self, mock_get):
         """Test device loading API call"""
         # Mock API response
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = [
-            {"_id": "1", "serial_number": "SN001", "name": "Device 1"},
-            {"_id": "2", "serial_number": "SN002", "name": "Device 2"}
-        ]
-        mock_get.return_value = mock_response
+        mock_get.return_value = _mock_ok(_DEVICE_PAYLOAD)
         
         # Simulate the API call
         headers = {"Authorization": "Bearer test_key", "Content-Type": "application/json"}
@@ -56,67 +132,91 @@ class TestBactoCloudDownloaderCore(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         devices = response.json()
         self.assertEqual(len(devices), 2)
+        self.assertEqual(loads_json(response.content), list(devices))
         self.assertEqual(devices[0]["serial_number"], "SN001")
     
     def test_file_organization(self):
         """Test file organization structure"""
-        from pathlib import Path
-        
         # Create test structure
         device_serial = "SN001"
         date_str = "2024-01-15_10-30-00"
         safe_name = "Test_Measurement"
         folder_name = f"{date_str}_{safe_name}"
         
-        output_path = Path(self.temp_dir) / device_serial / folder_name
-        output_path.mkdir(parents=True, exist_ok=True)
+        output_path = os.path.join(self.temp_dir, device_serial, folder_name)
+        _ensure_dir(output_path)
         
         # Create test files
-        json_path = output_path / "measurement.json"
+        json_path = os.path.join(output_path, "measurement.json")
         test_data = {"_id": "test_id", "name": "Test"}
-        with open(json_path, 'w') as f:
-            json.dump(test_data, f, indent=2)
+        with open(json_path, 'wb') as f:
+            f.write(dumps_json(test_data, pretty=True))
         
-        fcs_path = output_path / "data.fcs"
-        with open(fcs_path, 'wb') as f:
-            f.write(b"FCS file content")
+        # The FCS payload only needs to reach the file handle; the JSON file
+        # above already covers the on-disk round trip
+        fcs_path = os.path.join(output_path, "data.fcs")
+        fcs_part_path = os.path.join(output_path, "data.fcs.part")
+        with patch("builtins.open", mock_open()) as mocked_open, \
+             patch.object(bactocloud_downloader.os, "replace") as mocked_replace:
+            bactocloud_downloader.write_bytes_atomic(Path(fcs_path), b"FCS file content")
         
         # Verify structure
-        self.assertTrue(output_path.exists())
-        self.assertTrue(json_path.exists())
-        self.assertTrue(fcs_path.exists())
+        self.assertTrue(os.path.exists(output_path))
+        self.assertTrue(os.path.exists(json_path))
         
         # Verify content
-        with open(json_path, 'r') as f:
-            saved_data = json.load(f)
+        with open(json_path, 'rb') as f:
+            saved_data = loads_json(f.read())
         self.assertEqual(saved_data["_id"], "test_id")
         
-        with open(fcs_path, 'rb') as f:
-            fcs_content = f.read()
-        self.assertEqual(fcs_content, b"FCS file content")
+        # The payload goes to the .part file, which is then moved into place
+        mocked_open.assert_called_once_with(Path(fcs_part_path), 'wb')
+        mocked_open().write.assert_called_once_with(b"FCS file content")
+        mocked_replace.assert_called_once_with(Path(fcs_part_path), Path(fcs_path))
+    
+    def test_setup_ui_builds_widgets(self):
+        """Test that the main window can be laid out (widgets are mocked, no display needed)"""
+        app = Mock()
+        with patch.object(bactocloud_downloader, "ttk"), \
+             patch.object(bactocloud_downloader, "scrolledtext"), \
+             patch.object(bactocloud_downloader, "DateEntry"), \
+             patch.object(bactocloud_downloader.tk, "Listbox"), \
+             patch.object(bactocloud_downloader.tk, "StringVar"):
+            bactocloud_downloader.BactoCloudDownloader.setup_ui(app)
+        
+        # The log drain is scheduled once the widgets exist
+        app.root.after.assert_called_with(100, app.drain_log)
     
     def test_date_parsing(self):
         """Test date parsing for folder names"""
-        timestamp = "2024-01-15T10:30:00Z"
-        dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-        date_str = dt.strftime("%Y-%m-%d_%H-%M-%S")
+        self.assertEqual(folder_timestamp("2024-01-15T10:30:00Z"), "2024-01-15_10-30-00")
+        self.assertEqual(folder_timestamp("2024-01-15T10:30:00.123+02:00"), "2024-01-15_10-30-00")
         
-        self.assertEqual(date_str, "2024-01-15_10-30-00")
+        # Timestamps without seconds go through datetime parsing
+        self.assertEqual(folder_timestamp("2024-01-15T10:30Z"), "2024-01-15_10-30-00")
+        self.assertEqual(folder_timestamp("not a date"), "unknown_date")
     
     def test_name_sanitization(self):
         """Test measurement name sanitization for filesystem"""
         name = "Test / Measurement: With Special * Characters?"
-        safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '_', '-')).strip()
-        safe_name = safe_name or "unnamed"
-        
-        self.assertEqual(safe_name, "Test  Measurement With Special  Characters")
+        self.assertEqual(sanitize_name(name), "Test  Measurement With Special  Characters")
         
         # Test empty name
-        empty_name = "!@#$%^&*()"
-        safe_empty = "".join(c for c in empty_name if c.isalnum() or c in (' ', '_', '-')).strip()
-        safe_empty = safe_empty or "unnamed"
+        self.assertEqual(sanitize_name("!@#$%^&*()"), "unnamed")
+        
+        # Control characters and surrounding spaces are removed
+        self.assertEqual(sanitize_name(" \tSample_1\n "), "Sample_1")
         
-        self.assertEqual(safe_empty, "unnamed")
+        # Letters and digits of any script are kept, like str.isalnum()
+        self.assertEqual(sanitize_name("Échantillon_1 - µ"), "Échantillon_1 - µ")
+    
+    def test_serial_sanitization(self):
+        """Test that device serials only lose characters that cannot be in a folder name"""
+        # Valid serials are kept as they are, so existing device folders are reused
+        self.assertEqual(sanitize_serial("SN-001.A (lab)"), "SN-001.A (lab)")
+        self.assertEqual(sanitize_serial("SN/001:A"), "SN_001_A")
+        self.assertEqual(sanitize_serial(".."), "Unknown")
+        self.assertEqual(sanitize_serial(""), "Unknown")
 
 
 class TestBucketSelection(unittest.TestCase):
@@ -124,14 +224,7 @@ class TestBucketSelection(unittest.TestCase):
     
     def _build_bucket_list(self, bucket_auto, bucket_manual, bucket_monitoring):
         """Helper method to build bucket list based on selections"""
-        buckets = []
-        if bucket_auto:
-            buckets.append("auto")
-        if bucket_manual:
-            buckets.append("manual")
-        if bucket_monitoring:
-            buckets.append("monitoring")
-        return buckets
+        return list(_BUCKETS[bucket_auto << 2 | bucket_manual << 1 | bucket_monitoring])
     
     def test_bucket_filter_all_selected(self):
         """Test bucket filter with all buckets selected"""
@@ -180,9 +273,7 @@ class TestBucketSelection(unittest.TestCase):
             "buckets": buckets
         }
         
-        self.assertIn("buckets", filter_data)
-        self.assertEqual(filter_data["buckets"], ["auto", "manual"])
-        self.assertEqual(len(filter_data["buckets"]), 2)
+        self.assertEqual(filter_data.get("buckets"), ["auto", "manual"])
     
     def test_api_filter_without_buckets(self):
         """Test that API filter works without buckets (downloads all)"""
@@ -202,54 +293,26 @@ class TestBucketSelection(unittest.TestCase):
         self.assertNotIn("buckets", filter_data)
 
 
-class TestConfigPersistence(unittest.TestCase):
+class TestConfigPersistence(TempDirTestCase):
     """Test cases for configuration persistence"""
     
-    def setUp(self):
-        """Set up test fixtures"""
-        self.temp_dir = tempfile.mkdtemp()
-        
-    def tearDown(self):
-        """Clean up test fixtures"""
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
-    
     def test_config_save_and_load(self):
         """Test saving and loading configuration"""
-        from pathlib import Path
-        
-        config_file = Path(self.temp_dir) / "config.json"
-        
-        # Save config
-        test_config = {
-            "api_key": "test_key_123",
-            "output_dir": "/path/to/output"
-        }
-        
-        with open(config_file, 'w') as f:
-            json.dump(test_config, f, indent=2)
-        
-        # Load config
-        with open(config_file, 'r') as f:
-            loaded_config = json.load(f)
+        # Round-trip in memory; writing the file is covered by test_file_organization
+        loaded_config = loads_json(dumps_json(dict(_CONFIG_PAYLOAD)))
         
-        self.assertEqual(loaded_config["api_key"], "test_key_123")
-        self.assertEqual(loaded_config["output_dir"], "/path/to/output")
+        self.assertDictEqual(loaded_config, dict(_CONFIG_PAYLOAD))
     
     def test_config_directory_creation(self):
         """Test that config directory can be created"""
-        from pathlib import Path
-        
-        config_dir = Path(self.temp_dir) / "BactoCloudDownloader"
-        config_dir.mkdir(parents=True, exist_ok=True)
+        config_dir = os.path.join(self.temp_dir, "BactoCloudDownloader")
+        _ensure_dir(config_dir)
         
-        self.assertTrue(config_dir.exists())
-        self.assertTrue(config_dir.is_dir())
+        self.assertTrue(os.path.exists(config_dir))
+        self.assertTrue(os.path.isdir(config_dir))
     
     def test_config_file_not_exists(self):
         """Test handling when config file doesn't exist"""
-        from pathlib import Path
-        
         config_file = Path(self.temp_dir) / "nonexistent.json"
         
         # Should return False when file doesn't exist
@@ -257,8 +320,6 @@ class TestConfigPersistence(unittest.TestCase):
     
     def test_config_type_validation(self):
         """Test that config loading validates data types"""
-        from pathlib import Path
-        
         config_file = Path(self.temp_dir) / "config.json"
         
         # Save config with wrong types
@@ -267,79 +328,49 @@ class TestConfigPersistence(unittest.TestCase):
             "output_dir": ["not", "a", "string"]  # Should be string
         }
         
+        # Written with the stdlib json module, like config files of older versions
         with open(config_file, 'w') as f:
             json.dump(invalid_config, f, indent=2)
         
-        # Config file should exist
+        # Config file should exist and be readable by the orjson-backed loader
         self.assertTrue(config_file.exists())
+        self.assertEqual(loads_json(config_file.read_bytes()), invalid_config)
         
         # The load_config method should handle this gracefully
         # by not loading invalid types (tested in the main code)
     
     def test_config_with_bucket_selection(self):
         """Test saving and loading configuration with bucket selections"""
-        from pathlib import Path
-        
-        config_file = Path(self.temp_dir) / "config.json"
-        
-        # Save config with bucket selections
-        test_config = {
-            "api_key": "test_key_123",
-            "output_dir": "/path/to/output",
-            "bucket_auto": True,
-            "bucket_manual": False,
-            "bucket_monitoring": True
-        }
-        
-        with open(config_file, 'w') as f:
-            json.dump(test_config, f, indent=2)
-        
-        # Load config
-        with open(config_file, 'r') as f:
-            loaded_config = json.load(f)
+        # Round-trip a config with bucket selections in memory
+        loaded_config = loads_json(dumps_json(dict(_BUCKET_CONFIG_PAYLOAD)))
         
-        self.assertEqual(loaded_config["bucket_auto"], True)
-        self.assertEqual(loaded_config["bucket_manual"], False)
-        self.assertEqual(loaded_config["bucket_monitoring"], True)
+        self.assertDictEqual(loaded_config, dict(_BUCKET_CONFIG_PAYLOAD))
 
 
-class TestDirectorySelection(unittest.TestCase):
+class TestDirectorySelection(TempDirTestCase):
     """Test cases for directory selection functionality"""
     
-    def setUp(self):
-        """Set up test fixtures"""
-        self.temp_dir = tempfile.mkdtemp()
-    
-    def tearDown(self):
-        """Clean up test fixtures"""
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
-    
     def test_directory_exists_validation(self):
         """Test that directory existence can be validated"""
-        from pathlib import Path
-        
         # Create a test directory
-        test_dir = Path(self.temp_dir) / "test_output"
-        test_dir.mkdir(parents=True, exist_ok=True)
+        test_dir = os.path.join(self.temp_dir, "test_output")
+        _ensure_dir(test_dir)
         
         # Verify it exists
-        self.assertTrue(test_dir.exists())
-        self.assertTrue(test_dir.is_dir())
+        self.assertTrue(os.path.exists(test_dir))
+        self.assertTrue(os.path.isdir(test_dir))
     
     def test_directory_selection_path_update(self):
         """Test that directory path can be updated"""
-        from pathlib import Path
-        
         # Create test directories
-        initial_dir = Path(self.temp_dir) / "initial"
-        new_dir = Path(self.temp_dir) / "new_selection"
+        initial_dir = os.path.join(self.temp_dir, "initial")
+        new_dir = os.path.join(self.temp_dir, "new_selection")
         
-        initial_dir.mkdir(parents=True, exist_ok=True)
-        new_dir.mkdir(parents=True, exist_ok=True)
+        _ensure_dir(initial_dir)
+        _ensure_dir(new_dir)
         
         # Simulate directory selection
-        selected_dir = str(new_dir)
+        selected_dir = new_dir
         
         # Verify the path is valid
         self.assertTrue(os.path.exists(selected_dir))
@@ -352,8 +383,9 @@ class TestDateValidation(unittest.TestCase):
     def test_default_date_range(self):
         """Test that default date range is 3 months"""
         # Calculate expected default dates
-        today = datetime.now().date()
-        three_months_ago = (datetime.now() - timedelta(days=90)).date()
+        now = datetime.now()
+        today = now.date()
+        three_months_ago = (now - timedelta(days=90)).date()
         
         # Verify the dates are different
         self.assertNotEqual(today, three_months_ago)
@@ -390,26 +422,303 @@ class TestDateValidation(unittest.TestCase):
         self.assertNotEqual(start_date, end_date)
 
 
+class TestDownloadFile(TempDirTestCase):
+    """Test cases for skipping, resuming and restarting file downloads"""
+    
+    def setUp(self):
+        """Give each test a fresh target file"""
+        self.file_path = Path(self.temp_dir) / f"{self._testMethodName}.fcs"
+        self.part_path = self.file_path.with_name(self.file_path.name + ".part")
+        self.etag_path = self.file_path.with_name(self.file_path.name + ".etag")
+    
+    def test_not_modified_skips_download(self):
+        """Test that a 304 answer to If-None-Match leaves the local file alone"""
+        self.file_path.write_bytes(b"local")
+        self.etag_path.write_text('"v1"')
+        app = _make_downloader([_FakeResponse(304)])
+        
+        app.download_file("f1", self.file_path, "FCS")
+        
+        _, kwargs = app.make_request_with_retry.call_args
+        self.assertEqual(kwargs["headers"], {"If-None-Match": '"v1"'})
+        self.assertEqual(self.file_path.read_bytes(), b"local")
+        self.assertIn("f1", app.completed_files)
+    
+    def test_size_check_requests_identity_encoding(self):
+        """Test that the HEAD size check asks for the unencoded size"""
+        self.file_path.write_bytes(b"local")
+        app = _make_downloader([_FakeResponse(200, headers={"Content-Length": "5", "ETag": '"v1"'})])
+        
+        app.download_file("f1", self.file_path, "FCS")
+        
+        app.make_request_with_retry.assert_called_once_with(
+            'head', "https://api.example.com/api/v1/data/file/f1",
+            headers={"Accept-Encoding": "identity"}
+        )
+        self.assertEqual(self.etag_path.read_text(), '"v1"')
+        self.assertIn("f1", app.completed_files)
+    
+    def test_partial_content_is_appended(self):
+        """Test that a 206 answer resumes the .part file"""
+        self.part_path.write_bytes(b"head-")
+        app = _make_downloader([_FakeResponse(206, b"tail")])
+        
+        app.download_file("f1", self.file_path, "FCS")
+        
+        _, kwargs = app.make_request_with_retry.call_args
+        self.assertEqual(kwargs["headers"], {"Range": "bytes=5-", "Accept-Encoding": "identity"})
+        self.assertEqual(self.file_path.read_bytes(), b"head-tail")
+        self.assertFalse(self.part_path.exists())
+    
+    def test_full_answer_to_range_replaces_part(self):
+        """Test that a 200 answer to a range request overwrites the .part file"""
+        self.part_path.write_bytes(b"stale")
+        app = _make_downloader([_FakeResponse(200, b"whole file")])
+        
+        app.download_file("f1", self.file_path, "FCS")
+        
+        self.assertEqual(self.file_path.read_bytes(), b"whole file")
+        self.assertFalse(self.part_path.exists())
+    
+    def test_unsatisfiable_range_restarts_download(self):
+        """Test that a 416 answer discards the .part file and downloads from scratch"""
+        self.part_path.write_bytes(b"too long")
+        app = _make_downloader([_FakeResponse(416), _FakeResponse(200, b"fresh")])
+        
+        app.download_file("f1", self.file_path, "FCS")
+        
+        self.assertEqual(app.make_request_with_retry.call_count, 2)
+        _, kwargs = app.make_request_with_retry.call_args
+        self.assertEqual(kwargs["headers"], {})
+        self.assertEqual(self.file_path.read_bytes(), b"fresh")
+
+
+class TestIterMeasurements(unittest.TestCase):
+    """Test cases for listing measurements page by page"""
+    
+    @staticmethod
+    def _page(items, count=None, status_code=200):
+        """Build a data list response"""
+        body = {"data": items} if status_code == 200 else {"error": "rejected"}
+        if count is not None:
+            body["count"] = count
+        return _FakeResponse(status_code, dumps_json(body))
+    
+    @staticmethod
+    def _requested_pages(app):
+        """Return the (device_ids, page) of every data list request"""
+        filters = [loads_json(kwargs["data"]) for _, kwargs in app.make_request_with_retry.call_args_list]
+        return [(f["device_ids"], f["page"]) for f in filters]
+    
+    def test_pages_until_short_page(self):
+        """Test that pages are fetched until one comes back short"""
+        app = _make_downloader([
+            self._page([{"_id": 1}, {"_id": 2}]),
+            self._page([{"_id": 3}, {"_id": 4}]),
+            self._page([{"_id": 5}]),
+        ])
+        with patch.object(bactocloud_downloader, "DATA_LIST_PAGE_SIZE", 2):
+            items = list(app.iter_measurements([{"id": "d1"}], {"buckets": ["auto"]}))
+        
+        self.assertEqual([item["_id"] for item in items], [1, 2, 3, 4, 5])
+        self.assertEqual(self._requested_pages(app), [(["d1"], 0), (["d1"], 1), (["d1"], 2)])
+    
+    def test_stops_at_reported_count(self):
+        """Test that a full last page does not trigger another request when the count is reached"""
+        app = _make_downloader([
+            self._page([{"_id": 1}, {"_id": 2}], count=4),
+            self._page([{"_id": 3}, {"_id": 4}], count=4),
+        ])
+        with patch.object(bactocloud_downloader, "DATA_LIST_PAGE_SIZE", 2):
+            items = list(app.iter_measurements([{"id": "d1"}], {}))
+        
+        self.assertEqual(len(items), 4)
+        self.assertEqual(app.make_request_with_retry.call_count, 2)
+    
+    def test_rejected_group_falls_back_to_single_devices(self):
+        """Test that a rejected multi-device query is retried one device at a time"""
+        app = _make_downloader([
+            self._page([], status_code=400),
+            self._page([{"_id": "a"}]),
+            self._page([{"_id": "b"}]),
+        ])
+        devices = [{"id": "d1", "serial_number": "SN1"}, {"id": "d2", "serial_number": "SN2"}]
+        items = list(app.iter_measurements(devices, {}))
+        
+        self.assertEqual([item["_id"] for item in items], ["a", "b"])
+        self.assertEqual(self._requested_pages(app), [(["d1", "d2"], 0), (["d1"], 0), (["d2"], 0)])
+    
+    def test_non_json_error_falls_back_to_single_devices(self):
+        """Test that the per-device fallback also runs when the error body is not JSON"""
+        app = _make_downloader([
+            _FakeResponse(502, b"<html>Bad Gateway</html>"),
+            self._page([{"_id": "a"}]),
+            self._page([{"_id": "b"}]),
+        ])
+        devices = [{"id": "d1", "serial_number": "SN1"}, {"id": "d2", "serial_number": "SN2"}]
+        items = list(app.iter_measurements(devices, {}))
+        
+        self.assertEqual([item["_id"] for item in items], ["a", "b"])
+        app.log.assert_any_call("Error fetching data for SN1, SN2: Unknown error")
+    
+    def test_null_serial_number(self):
+        """Test that a device whose serial number is null is listed as Unknown"""
+        app = _make_downloader([self._page([{"_id": "a"}])])
+        items = list(app.iter_measurements([{"id": "d1", "serial_number": None}], {}))
+        
+        self.assertEqual(items, [{"_id": "a"}])
+        app.log.assert_any_call("\nProcessing device: Unknown")
+    
+    def test_rejected_single_device_is_skipped(self):
+        """Test that a rejected single-device query yields nothing and is not retried"""
+        app = _make_downloader([self._page([], status_code=400)])
+        
+        self.assertEqual(list(app.iter_measurements([{"id": "d1"}], {})), [])
+        self.assertEqual(app.make_request_with_retry.call_count, 1)
+
+
+class TestDownloadData(TempDirTestCase):
+    """Test cases for running a whole download on the thread pool"""
+    
+    def _run(self, devices, lists, abort_on_list=False):
+        """Download the given devices, answering each list query from lists[device_ids]"""
+        output_dir = os.path.join(self.temp_dir, self._testMethodName)
+        
+        def fake_request(method, url, **kwargs):
+            if url.endswith("/api/v1/data/list"):
+                if abort_on_list:
+                    # The user aborts while the list is being fetched
+                    app.abort_event.set()
+                answer = lists[tuple(loads_json(kwargs["data"])["device_ids"])]
+                if isinstance(answer, Exception):
+                    raise answer
+                return _FakeResponse(200, dumps_json({"data": answer}))
+            return _FakeResponse(200, f"payload {url.rsplit('/', 1)[-1]}".encode())
+        
+        app = _make_downloader(fake_request)
+        app.selected_devices = devices
+        app.selected_buckets = ["auto"]
+        app.selected_start_date = date(2024, 1, 1)
+        app.selected_end_date = date(2024, 1, 31)
+        app.selected_output_dir = output_dir
+        app.selected_parallel_downloads = 4
+        app.selected_pretty_json = False
+        app.progress_bar = Mock()
+        app.download_btn = Mock()
+        app.abort_btn = Mock()
+        with patch.object(bactocloud_downloader.messagebox, "showinfo") as showinfo, \
+             patch.object(bactocloud_downloader.messagebox, "showerror") as showerror:
+            app.download_data()
+        
+        showerror.assert_not_called()
+        return app, showinfo, output_dir
+    
+    def test_failing_group_does_not_stop_other_devices(self):
+        """Test that files are downloaded for every group whose listing succeeds"""
+        devices = [
+            {"id": "d1", "serial_number": "SN1"},
+            {"id": "d2", "serial_number": None},
+            {"id": "v1", "serial_number": "VIRT", "virtual": True}
+        ]
+        lists = {
+            ("d1", "d2"): [
+                {"_id": "m1", "deviceID": "d1", "timestamp": "2024-01-15T10:30:00Z",
+                 "name": "Sample", "files": {"20": "f1", "30": "f2"}},
+                {"_id": "m2", "deviceID": "d2", "timestamp": "2024-01-16T08:00:00Z",
+                 "name": "Sample", "files": {"20": "f3"}}
+            ],
+            ("v1",): bactocloud_downloader.requests.ConnectionError("listing failed")
+        }
+        app, showinfo, output_dir = self._run(devices, lists)
+        
+        showinfo.assert_called_once_with("Success", "Downloaded 2 measurements")
+        app.log.assert_any_call("Error processing VIRT: listing failed")
+        
+        folder = os.path.join(output_dir, "SN1", "2024-01-15_10-30-00_Sample")
+        with open(os.path.join(folder, "2024-01-15_10-30-00_Sample_data.fcs"), 'rb') as f:
+            self.assertEqual(f.read(), b"payload f1")
+        with open(os.path.join(folder, "2024-01-15_10-30-00_Sample_diagnostics.csv"), 'rb') as f:
+            self.assertEqual(f.read(), b"payload f2")
+        # A device without a serial number is saved under "Unknown"
+        folder = os.path.join(output_dir, "Unknown", "2024-01-16_08-00-00_Sample")
+        with open(os.path.join(folder, "2024-01-16_08-00-00_Sample_data.fcs"), 'rb') as f:
+            self.assertEqual(f.read(), b"payload f3")
+        self.assertEqual(app.completed_files, {"f1", "f2", "f3"})
+    
+    def test_same_target_path_is_downloaded_once(self):
+        """Test that measurements sharing a folder and file name do not download to the same file twice"""
+        devices = [{"id": "d1", "serial_number": "SN1"}]
+        lists = {("d1",): [
+            {"_id": "m1", "timestamp": "2024-01-15T10:30:00Z", "name": "Twin", "files": {"20": "f1"}},
+            {"_id": "m2", "timestamp": "2024-01-15T10:30:00Z", "name": "Twin", "files": {"20": "f2"}}
+        ]}
+        app, showinfo, output_dir = self._run(devices, lists)
+        
+        showinfo.assert_called_once_with("Success", "Downloaded 2 measurements")
+        self.assertEqual(app.completed_files, {"f1"})
+        folder = os.path.join(output_dir, "SN1", "2024-01-15_10-30-00_Twin")
+        with open(os.path.join(folder, "2024-01-15_10-30-00_Twin_data.fcs"), 'rb') as f:
+            self.assertEqual(f.read(), b"payload f1")
+    
+    def test_abort_skips_queued_files(self):
+        """Test that an abort during the listing downloads no files"""
+        devices = [{"id": "d1", "serial_number": "SN1"}]
+        lists = {("d1",): [{"_id": "m1", "timestamp": "2024-01-15T10:30:00Z", "files": {"20": "f1"}}]}
+        app, showinfo, _ = self._run(devices, lists, abort_on_list=True)
+        
+        self.assertEqual(showinfo.call_args[0][0], "Aborted")
+        self.assertFalse(app.completed_files)
+        # Only the list query was sent
+        app.make_request_with_retry.assert_called_once()
+    
+    def test_list_query_has_fixed_order(self):
+        """Test that the paged data list is sorted, so pages do not shift between requests"""
+        devices = [{"id": "d1", "serial_number": "SN1"}]
+        app, _, _ = self._run(devices, {("d1",): []})
+        
+        _, kwargs = app.make_request_with_retry.call_args
+        filter_data = loads_json(kwargs["data"])
+        self.assertEqual((filter_data["sort_field"], filter_data["sort_order"]), ("timestamp", "asc"))
+
+
 class TestAbortFunctionality(unittest.TestCase):
     """Test cases for abort functionality"""
     
     def test_abort_flag_initialization(self):
         """Test that abort flag is initialized to False"""
-        abort_flag = False
-        self.assertFalse(abort_flag)
+        abort_event = threading.Event()
+        self.assertFalse(abort_event.is_set())
     
     def test_abort_flag_set(self):
         """Test that abort flag can be set to True"""
-        abort_flag = False
-        abort_flag = True
-        self.assertTrue(abort_flag)
+        abort_event = threading.Event()
+        abort_event.set()
+        self.assertTrue(abort_event.is_set())
     
     def test_abort_flag_reset(self):
         """Test that abort flag is reset before download"""
-        abort_flag = True
+        abort_event = threading.Event()
+        abort_event.set()
         # Before starting download, reset the flag
-        abort_flag = False
-        self.assertFalse(abort_flag)
+        abort_event.clear()
+        self.assertFalse(abort_event.is_set())
+    
+    def test_abort_interrupts_retry_wait(self):
+        """Test that an aborted download does not wait out a 429 retry delay"""
+        app = _make_downloader([])
+        app.session = Mock()
+        app.session.get.return_value = _FakeResponse(429)
+        app.abort_event.set()
+        
+        started = time.monotonic()
+        response = bactocloud_downloader.BactoCloudDownloader.make_request_with_retry(
+            app, 'get', "https://api.example.com/api/v1/devices"
+        )
+        
+        # The 30 second wait is cut short and the 429 is handed back without retrying
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.status_code, 429)
+        app.session.get.assert_called_once()
 
 
 if __name__ == '__main__':